@@ -1,22 +1,279 @@
 import os
-import re
 import json
 import importlib.util
+import functools
 import random
+import threading
+from collections import deque
+from collections.abc import Mapping
+from difflib import SequenceMatcher
+from concurrent.futures import ThreadPoolExecutor
 
-# Regular expression to extract requirements JSON from variation files
-REQUIREMENTS_PATTERN = re.compile(r'REQUIREMENTS_BEGIN\s*({.*?})\s*REQUIREMENTS_END', re.DOTALL)
+# 优先使用更快的 JSON 解析器（可选依赖），均可直接解析 bytes
+try:
+    import orjson
+    _json_loads = orjson.loads
+    _JSONDecodeError = orjson.JSONDecodeError
+except ImportError:
+    try:
+        import msgspec
+        _json_loads = msgspec.json.decode
+        _JSONDecodeError = msgspec.DecodeError
+    except ImportError:
+        _json_loads = json.loads
+        _JSONDecodeError = json.JSONDecodeError
 
-# Dictionary to store variation mappings
-variations = {
-    'echarts_py': {},  # chart_type -> module
-    'echarts-js': {},  # chart_type -> js_file_path
-    'd3-js': {},        # chart_type -> js_file_path
-    'vegalite_py': {}   # chart_type -> module
-}
+def _loads_json(data):
+    """Parse JSON bytes with the fastest available parser, falling back to the stdlib json module"""
+    try:
+        return _json_loads(data)
+    except _JSONDecodeError:
+        if _json_loads is json.loads:
+            raise
+    # orjson 与 msgspec 严格遵循 JSON 标准，标准库 json 还接受 NaN、Infinity 等写法，结果以其为准
+    return json.loads(data)
+
+# 模板引擎主目录（即本文件所在目录）
+_VARIATION_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Markers enclosing the requirements JSON in variation files
+REQUIREMENTS_BEGIN = b'REQUIREMENTS_BEGIN'
+REQUIREMENTS_END = b'REQUIREMENTS_END'
+
+# requirements 块位于文件开头，开始标记须出现在前这么多字节内
+REQUIREMENTS_HEAD_SIZE = 16384
+
+# 各引擎模板目录及对应的文件扩展名，扫描时每个引擎各占一个线程
+_ENGINE_EXTENSIONS = (
+    ('echarts_py', '.py'),
+    ('echarts-js', '.js'),
+    ('d3-js', '.js'),
+    ('vegalite_py', '.py'),
+)
+
+# 保护并行扫描时对共享注册表的写入
+_registry_lock = threading.Lock()
+
+class _TemplateStore:
+    """
+    扁平的模板存储：每个模板占一行，各字段按行号保存在并行列表中
+    """
+    
+    def __init__(self):
+        self.clear()
+    
+    def __len__(self):
+        return len(self.engines)
+    
+    def clear(self):
+        self.engines = []
+        self.chart_types = []
+        self.chart_names = []
+        self.variations = []
+        self.requirements = []
+        # (engine, chart_type, chart_name) -> 行号
+        self.rows = {}
+        # 已加载的 Python 模板模块：file_path -> module，随本次扫描结果一起替换
+        self.modules = {}
+    
+    def add(self, engine, chart_type, chart_name, variation, requirements):
+        """Register a template row, replacing an earlier row with the same key"""
+        key = (engine, chart_type, chart_name)
+        row = self.rows.get(key)
+        if row is None:
+            self.rows[key] = len(self.engines)
+            self.engines.append(engine)
+            self.chart_types.append(chart_type)
+            self.chart_names.append(chart_name)
+            self.variations.append(variation)
+            self.requirements.append(requirements)
+        else:
+            self.variations[row] = variation
+            self.requirements[row] = requirements
+    
+    def sort_by_engine(self, engine_order):
+        """Reorder rows by engine_order, keeping the registration order within each engine"""
+        rank = {engine: i for i, engine in enumerate(engine_order)}
+        order = sorted(range(len(self)), key=lambda row: rank[self.engines[row]])
+        for field in ('engines', 'chart_types', 'chart_names', 'variations', 'requirements'):
+            values = getattr(self, field)
+            setattr(self, field, [values[row] for row in order])
+        self.rows = {
+            key: row for row, key in enumerate(zip(self.engines, self.chart_types, self.chart_names))
+        }
+
+class _VariationsView(Mapping):
+    """
+    只读视图：按旧格式 engine -> chart_type -> chart_name -> info 访问扁平存储，兼容已有调用方
+    """
+    
+    def __getitem__(self, engine):
+        if engine not in _ENGINE_NAMES:
+            raise KeyError(engine)
+        return _registry.engine_view(engine)
+    
+    def __iter__(self):
+        return iter(_ENGINE_NAMES)
+    
+    def __len__(self):
+        return len(_ENGINE_NAMES)
+
+_ENGINE_NAMES = tuple(engine for engine, _ in _ENGINE_EXTENSIONS)
+
+class _Registry:
+    """
+    一次扫描的完整结果：模板存储及由其构建的查找索引，值均为 store 中的行号
+    
+    构建完成后不再修改，重新扫描时整体替换 _registry，读取方无需加锁
+    """
+    
+    def __init__(self, store):
+        self.store = store
+        # chart_name -> 行号，同名时按引擎顺序取第一个
+        self.name_index = {}
+        # (engine, chart_type) -> 该类型下全部模板的行号元组，供随机选择
+        self.by_engine_type = {}
+        # chart_type -> [(engine, chart_type)]，即注册了该 chart_type 的全部引擎
+        self.by_chart_type = {}
+        # chart_type 的全部子串 -> [(engine, chart_type)]，用于 chart_type 的部分匹配
+        self.substr_index = {}
+        # 已注册 chart_type 的全部长度，查询串只需切出这些长度的子串
+        self.chart_type_lengths = set()
+        # (engine, chart_type) -> 该 chart_type 的注册顺序，部分匹配时按此顺序优先
+        self.chart_type_order = {}
+        # 每个模板 chart_name 的 trigram 数量，按行号对齐
+        self.template_gram_counts = []
+        # 模糊匹配用的 trigram 倒排索引：trigram -> [行号]
+        self.trigram_index = {}
+        # engine -> 旧格式视图，首次访问时生成
+        self._engine_views = {}
+        self._build_indexes()
+    
+    def _build_indexes(self):
+        """Build the lookup indexes from the template store"""
+        store = self.store
+        rows_by_type = {}
+        for row, (engine, chart_type, name) in enumerate(zip(store.engines, store.chart_types, store.chart_names)):
+            key = (engine, chart_type)
+            rows = rows_by_type.get(key)
+            if rows is None:
+                rows = rows_by_type[key] = []
+                self.chart_type_order[key] = len(self.chart_type_order)
+                self.by_chart_type.setdefault(chart_type, []).append(key)
+                self.chart_type_lengths.add(len(chart_type))
+                for sub in _substrings(chart_type):
+                    self.substr_index.setdefault(sub, []).append(key)
+            rows.append(row)
+            
+            self.name_index.setdefault(name, row)
+            grams = _trigrams(name)
+            self.template_gram_counts.append(len(grams))
+            for gram in grams:
+                self.trigram_index.setdefault(gram, []).append(row)
+        
+        for key, rows in rows_by_type.items():
+            self.by_engine_type[key] = tuple(rows)
+    
+    def partial_chart_type_matches(self, chart_type):
+        """Return the (engine, chart_type) keys that contain chart_type or are contained in it"""
+        # 已注册的 chart_type 包含查询串
+        matches = set(self.substr_index.get(chart_type, ()))
+        # 查询串包含已注册的 chart_type：只切出与已注册 chart_type 等长的子串逐个查找
+        length = len(chart_type)
+        types_get = self.by_chart_type.get
+        for sub_length in self.chart_type_lengths:
+            if sub_length > length:
+                continue
+            for i in range(length - sub_length + 1):
+                keys = types_get(chart_type[i:i + sub_length])
+                if keys:
+                    matches.update(keys)
+        return matches
+    
+    def match_chart_name(self, chart_name):
+        """Return the row of the template whose chart_name is most similar to chart_name, or None"""
+        query_grams = _trigrams(chart_name)
+        hits = {}
+        hits_get = hits.get
+        index_get = self.trigram_index.get
+        for gram in query_grams:
+            for row in index_get(gram, ()):
+                hits[row] = hits_get(row, 0) + 1
+        if not hits:
+            return None
+        
+        # 按 trigram 的 Jaccard 相似度排序，取最高分
+        query_count = len(query_grams)
+        gram_counts = self.template_gram_counts
+        scores = {
+            row: count / (query_count + gram_counts[row] - count)
+            for row, count in hits.items()
+        }
+        best_score = max(scores.values())
+        best_rows = sorted(row for row, score in scores.items() if score == best_score)
+        if len(best_rows) == 1:
+            return best_rows[0]
+        
+        # 分数相同时用 SequenceMatcher 决出，仍相同则取扫描顺序靠前者
+        chart_names = self.store.chart_names
+        return max(best_rows, key=lambda row: SequenceMatcher(None, chart_name, chart_names[row]).ratio())
+    
+    def engine_view(self, engine):
+        """
+        Return the legacy chart_type -> chart_name -> info mapping for one engine
+        
+        与旧接口一致，echarts_py 的 'variation' 为已加载的模块（首次访问该引擎时加载），其余引擎为文件路径；
+        结果按引擎缓存，同一次扫描内重复访问不会重新构建
+        """
+        view = self._engine_views.get(engine)
+        if view is None:
+            store = self.store
+            view = {}
+            for (row_engine, chart_type), rows in self.by_engine_type.items():
+                if row_engine == engine:
+                    view[chart_type] = {store.chart_names[row]: self.info(row) for row in rows}
+            self._engine_views[engine] = view
+        return view
+    
+    def info(self, row):
+        """Return the template at row in the legacy variation info format"""
+        store = self.store
+        return {
+            'engine_type': store.engines[row],
+            'variation': _resolve_variation(self, row),
+            'requirements': store.requirements[row]
+        }
+
+# 当前生效的扫描结果，重新扫描时整体替换
+_registry = _Registry(_TemplateStore())
+
+# 兼容旧接口的 engine -> chart_type -> chart_name -> info 映射
+variations = _VariationsView()
+
+# 绑定到模块级名称，热点路径上省去属性查找
+_rand_choice = random.choice
 
 # 全局标识符，用于跟踪是否已扫描过模板
 _variations_scanned = False
+# 保证并发调用时只有一个线程执行扫描
+_scan_lock = threading.Lock()
+
+# 扫描结果缓存文件，记录每个模板文件的 mtime 与 requirements，
+# 热启动时只需重新解析 mtime 发生变化的文件
+_CACHE_PATH = os.path.join(_VARIATION_DIR, '.template_registry.cache.json')
+_CACHE_VERSION = 2
+
+# 上一次扫描持久化的结果：file_path -> {'mtime': ..., 'requirements': ...}
+_cached_files = {}
+# 本次扫描得到的结果，扫描结束后写回缓存文件
+_scanned_files = {}
+
+# 以模块形式提供的模板引擎，扫描时只记录文件路径，首次使用时才加载模块
+_PY_MODULE_ENGINES = ('echarts_py',)
+# 设置 TEMPLATE_REGISTRY_EAGER=1 时在扫描阶段加载全部 Python 模板，便于 CI 及早发现错误
+_EAGER_LOAD = os.environ.get('TEMPLATE_REGISTRY_EAGER') == '1'
+# 设置 TEMPLATE_REGISTRY_DEBUG=1 时打印每个注册的模板
+_DEBUG = os.environ.get('TEMPLATE_REGISTRY_DEBUG') == '1'
 
 def load_python_variation(file_path):
     """Load a Python variation module from a file path"""
@@ -26,79 +283,192 @@ def load_python_variation(file_path):
     spec.loader.exec_module(module)
     return module
 
+def _resolve_variation(registry, row):
+    """Return the variation stored at a template row, loading Python modules on first access"""
+    store = registry.store
+    variation = store.variations[row]
+    if store.engines[row] in _PY_MODULE_ENGINES and isinstance(variation, str):
+        module = store.modules.get(variation)
+        if module is None:
+            module = store.modules[variation] = load_python_variation(variation)
+        return module
+    return variation
+
 def extract_requirements(file_path):
     """Extract requirements JSON from a variation file"""
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
+    with open(file_path, 'rb') as f:
+        content = f.read(REQUIREMENTS_HEAD_SIZE)
+        # requirements 块必须位于文件开头，文件头中没有开始标记则不是模板，无需继续读取
+        last_begin = content.rfind(REQUIREMENTS_BEGIN)
+        if last_begin < 0:
+            return None
+        # 文件头中最后一个开始标记之后没有结束标记时再读取剩余内容
+        # （前面的标记可能只是注释中提到的标记名，真正的块可能延续到文件头之后）
+        if content.find(REQUIREMENTS_END, last_begin) < 0:
+            content += f.read()
     
-    # Find requirements section
-    match = REQUIREMENTS_PATTERN.search(content)
-    if match:
-        try:
-            requirements = json.loads(match.group(1))
-            return requirements
-        except json.JSONDecodeError:
-            print(f"Warning: Invalid JSON in requirements section of {file_path}")
+    # Find requirements section between the two literal markers
+    # 与原正则一致，跳过后面不是 {...} 的开始标记（如注释中提到的标记名），继续在文件头中查找下一个
+    start = content.find(REQUIREMENTS_BEGIN, 0, REQUIREMENTS_HEAD_SIZE)
+    while start >= 0:
+        start += len(REQUIREMENTS_BEGIN)
+        end = content.find(REQUIREMENTS_END, start)
+        if end < 0:
+            return None
+        blob = content[start:end].strip()
+        if blob.startswith(b'{') and blob.endswith(b'}'):
+            break
+        start = content.find(REQUIREMENTS_BEGIN, start, REQUIREMENTS_HEAD_SIZE)
+    else:
+        return None
+    
+    # 只把 requirements 片段交给解析器，由其按 UTF-8 解码；非 UTF-8 内容同样视为无效
+    try:
+        requirements = _loads_json(blob)
+        return requirements
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        print(f"Warning: Invalid JSON in requirements section of {file_path}")
     return None
 
-def scan_directory(dir_path, engine_type, file_extension):
+def _load_scan_cache():
+    """Load the persisted scan result, returning an empty dict if it is missing or stale"""
+    try:
+        with open(_CACHE_PATH, 'rb') as f:
+            cache = _loads_json(f.read())
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(cache, dict) or cache.get('version') != _CACHE_VERSION:
+        return {}
+    # 缓存只是加速手段，格式不符时整体丢弃，不能影响模板注册
+    files = cache.get('files')
+    if not isinstance(files, dict):
+        return {}
+    for cached in files.values():
+        if not (isinstance(cached, dict)
+                and type(cached.get('mtime')) is int
+                and isinstance(cached.get('requirements'), (dict, type(None)))):
+            return {}
+    return files
+
+def _save_scan_cache(files):
+    """Atomically write the scan result next to this module"""
+    tmp_path = f"{_CACHE_PATH}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': _CACHE_VERSION, 'files': files}, f, ensure_ascii=False)
+        os.replace(tmp_path, _CACHE_PATH)
+    except OSError:
+        # 缓存只是加速手段，目录不可写时直接放弃
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+def _get_requirements(entry):
+    """Return requirements for a scanned file, reusing the cached copy when its mtime is unchanged"""
+    mtime = entry.stat(follow_symlinks=False).st_mtime_ns
+    cached = _cached_files.get(entry.path)
+    if cached is not None and cached.get('mtime') == mtime:
+        requirements = cached.get('requirements')
+    else:
+        requirements = extract_requirements(entry.path)
+    with _registry_lock:
+        _scanned_files[entry.path] = {'mtime': mtime, 'requirements': requirements}
+    return requirements
+
+def scan_directory(dir_path, engine_type, file_extension, store=None):
     """
-    递归扫描目录及其子目录，寻找符合条件的模板文件
+    扫描目录及其子目录，寻找符合条件的模板文件（使用队列迭代遍历，不递归）
     
     Args:
         dir_path: 要扫描的目录路径
         engine_type: 引擎类型，'echarts_py', 'echarts-js' 或 'd3-js'
-        file_extension: 文件扩展名，'.py' 或 '.js'
+        file_extension: 文件扩展名，'.py' 或 '.js'，也可以是多个扩展名组成的元组
+        store: 注册模板的 _TemplateStore，为 None 时新建一个
+        
+    Returns:
+        注册了扫描到的模板的 _TemplateStore
     """
-    if not os.path.exists(dir_path):
-        return
+    if store is None:
+        store = _TemplateStore()
+    
+    # 统一为扩展名元组，str.endswith 可一次匹配多个后缀
+    suffixes = (file_extension,) if isinstance(file_extension, str) else tuple(file_extension)
+    # 仅Python模板需要跳过以__开头的文件
+    skip_dunder = '.py' in suffixes
+    
+    # 循环内频繁使用的对象预先绑定为局部变量
+    store_add = store.add
+    get_requirements = _get_requirements
+    basename = os.path.basename
     
-    # 遍历目录中的所有文件和子目录
-    for item in os.listdir(dir_path):
-        item_path = os.path.join(dir_path, item)
+    pending = deque([dir_path])
+    while pending:
+        current_dir = pending.popleft()
         
-        # 如果是目录，递归扫描
-        if os.path.isdir(item_path):
-            scan_directory(item_path, engine_type, file_extension)
+        # 遍历目录中的所有文件和子目录，DirEntry 自带类型信息，无需额外 stat
+        try:
+            with os.scandir(current_dir) as it:
+                entries = list(it)
+        except FileNotFoundError:
+            continue
         
-        # 如果是符合条件的文件
-        elif os.path.isfile(item_path) and item.endswith(file_extension):
-            # 对于Python文件，跳过以__开头的文件
-            if file_extension == '.py' and item.startswith('__'):
+        for entry in entries:
+            item = entry.name
+            item_path = entry.path
+            
+            # 如果是目录，加入待扫描队列（__pycache__ 中不会有模板，直接跳过）
+            if entry.is_dir(follow_symlinks=False):
+                if item != '__pycache__':
+                    pending.append(item_path)
+            
+            # 对于Python模板，跳过以__开头的文件
+            elif skip_dunder and item.startswith('__'):
                 continue
-                
-            # 提取需求并注册模板
-            requirements = extract_requirements(item_path)
-            # if engine_type == 'vegalite_py':
-            #     print(f"requirements: {requirements['chart_name']}")
-            if requirements and 'chart_type' in requirements:
-                chart_type = requirements['chart_type'].lower()
-                
-                # 获取chart_name，如果没有则使用文件名
-                chart_name = requirements.get('chart_name', os.path.basename(item_path).split('.')[0]).lower()
-                
-                # 如果该chart_type还不存在，初始化一个空字典
-                if chart_type not in variations[engine_type]:
-                    variations[engine_type][chart_type] = {}
-                
-                # 根据引擎类型处理不同的模板
-                if engine_type == 'echarts_py':
-                    variation = load_python_variation(item_path)
-                else:  # echarts-js 或 d3-js
+            
+            # 如果是符合条件的文件
+            # 先做廉价的后缀判断，再确认是普通文件
+            elif item.endswith(suffixes) and entry.is_file(follow_symlinks=False):
+                # 提取需求并注册模板（mtime 未变化时直接复用缓存）
+                requirements = get_requirements(entry)
+                # if engine_type == 'vegalite_py':
+                #     print(f"requirements: {requirements['chart_name']}")
+                if requirements and 'chart_type' in requirements:
+                    chart_type = requirements['chart_type'].lower()
+                    
+                    # 获取chart_name，如果没有则使用文件名
+                    chart_name = requirements.get('chart_name', basename(item_path).split('.')[0]).lower()
+                    
+                    # 统一只记录文件路径，Python 模板在首次使用时由 _resolve_variation 加载
                     variation = item_path
-                
-                # 存储模板信息为 [engine, variation]
-                variations[engine_type][chart_type][chart_name] = {
-                    'engine_type': engine_type,
-                    'variation': variation,
-                    'requirements': requirements
-                }
+                    module = None
+                    if _EAGER_LOAD and engine_type in _PY_MODULE_ENGINES:
+                        module = load_python_variation(item_path)
                     
-                # 计算相对于模板引擎主目录的路径
-                variation_dir = os.path.dirname(os.path.abspath(__file__))
-                engine_dir = os.path.join(variation_dir, engine_type)
-                rel_path = os.path.relpath(item_path, engine_dir)
-                # print(f"Registered {engine_type} variation: {chart_type} -> {chart_name} -> {rel_path}")
+                    with _registry_lock:
+                        if module is not None:
+                            store.modules[item_path] = module
+                        store_add(engine_type, chart_type, chart_name, variation, requirements)
+                        
+                    if _DEBUG:
+                        # 计算相对于模板引擎主目录的路径
+                        rel_path = os.path.relpath(item_path, os.path.join(_VARIATION_DIR, engine_type))
+                        print(f"Registered {engine_type} variation: {chart_type} -> {chart_name} -> {rel_path}")
+    
+    return store
+
+def _trigrams(text):
+    """Return the set of character trigrams of text (the whole string if it is shorter)"""
+    if len(text) < 3:
+        return {text} if text else set()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def _substrings(text):
+    """Return the set of all substrings of text, including the empty string"""
+    length = len(text)
+    substrings = {text[i:j] for i in range(length) for j in range(i + 1, length + 1)}
+    substrings.add('')
+    return substrings
 
 def scan_variations(force=False):
     """
@@ -107,39 +477,101 @@ def scan_variations(force=False):
     Args:
         force: 如果为True，即使已经扫描过也会强制重新扫描
     """
-    global _variations_scanned
+    global _variations_scanned, _registry, _cached_files, _scanned_files
     
     # 如果已经扫描过且不强制重新扫描，则直接返回
     if _variations_scanned and not force:
         return variations
     
-    # 清空现有模板
-    variations['vegalite_py'].clear()
-    variations['echarts_py'].clear()
-    variations['echarts-js'].clear()
-    variations['d3-js'].clear()
+    with _scan_lock:
+        # 等待锁期间其他线程可能已完成扫描
+        if _variations_scanned and not force:
+            return variations
+        
+        # 读取上一次的扫描缓存
+        _cached_files = _load_scan_cache()
+        _scanned_files = {}
+        
+        # 在新的存储中扫描，不影响正在使用旧结果的读取方
+        store = _TemplateStore()
+        
+        # 各引擎目录互不相关，并行扫描以重叠文件 I/O
+        with ThreadPoolExecutor(max_workers=len(_ENGINE_EXTENSIONS)) as executor:
+            futures = [
+                executor.submit(scan_directory, os.path.join(_VARIATION_DIR, engine_type), engine_type, file_extension, store)
+                for engine_type, file_extension in _ENGINE_EXTENSIONS
+            ]
+            # 等待全部完成，并将扫描中的异常抛出
+            for future in futures:
+                future.result()
+        
+        # 并行扫描的注册顺序不确定，按引擎顺序重排后再构建索引
+        store.sort_by_engine(_ENGINE_NAMES)
+        registry = _Registry(store)
+        
+        # 整体替换扫描结果，并清空依赖旧结果的缓存
+        _registry = registry
+        _resolve_variation_for_chart_type.cache_clear()
+        _resolve_variation_for_chart_name.cache_clear()
+        
+        # 仅在扫描结果有变化时回写缓存
+        if _scanned_files != _cached_files:
+            _save_scan_cache(_scanned_files)
+        _cached_files = {}
+        
+        # 标记已完成扫描
+        _variations_scanned = True
+    return variations
+
+@functools.lru_cache(maxsize=1024)
+def _resolve_variation_for_chart_type(registry, chart_type, engine_preference):
+    """
+    Resolve the candidate templates for a chart type
     
-    variation_dir = os.path.dirname(os.path.abspath(__file__))
+    Args:
+        registry: The _Registry to search; part of the cache key so rows never outlive their store
+        chart_type: The lower-cased chart type to look for
+        engine_preference: Tuple of engines in the order of preference
+        
+    Returns:
+        tuple of template rows to choose from, empty if nothing matches
+    """
+    # 引擎 -> 偏好排名，重复出现的引擎以第一次为准
+    rank = {}
+    for i, engine in enumerate(engine_preference):
+        rank.setdefault(engine, i)
     
-    # 扫描 echarts_py 目录及子目录
-    echarts_py_dir = os.path.join(variation_dir, 'echarts_py')
-    scan_directory(echarts_py_dir, 'echarts_py', '.py')
+    # Exact match: pick the most preferred engine that registered this chart type
+    candidates = [key for key in registry.by_chart_type.get(chart_type, ()) if key[0] in rank]
+    if candidates:
+        return registry.by_engine_type[min(candidates, key=lambda key: rank[key[0]])]
     
-    # 扫描 echarts-js 目录及子目录
-    echarts_js_dir = os.path.join(variation_dir, 'echarts-js')
-    scan_directory(echarts_js_dir, 'echarts-js', '.js')
+    # Try partial matches
+    candidates = [key for key in registry.partial_chart_type_matches(chart_type) if key[0] in rank]
+    if candidates:
+        # 与逐个遍历时一致，先按引擎偏好，再取该引擎内最先注册的 chart_type
+        chart_type_order = registry.chart_type_order
+        return registry.by_engine_type[min(candidates, key=lambda key: (rank[key[0]], chart_type_order[key]))]
     
-    # 扫描 d3-js 目录及子目录
-    d3_js_dir = os.path.join(variation_dir, 'd3-js')
-    scan_directory(d3_js_dir, 'd3-js', '.js')
+    return ()
+
+@functools.lru_cache(maxsize=1024)
+def _resolve_variation_for_chart_name(registry, chart_name):
+    """Resolve the template row for a lower-cased chart name in registry, or None"""
+    # Exact match via the precomputed name index
+    row = registry.name_index.get(chart_name)
+    if row is not None:
+        return row
     
-    # 扫描 vegalite_py 目录及子目录
-    vegalite_py_dir = os.path.join(variation_dir, 'vegalite_py')
-    scan_directory(vegalite_py_dir, 'vegalite_py', '.py')
+    # Try partial matches
+    # for engine in engine_preference:
+    #     for chart_type, chart_dict in variations[engine].items():
+    #         for name in chart_dict:
+    #             if chart_name in name or name in chart_name:
+    #                 return chart_dict[name]
     
-    # 标记已完成扫描
-    _variations_scanned = True
-    return variations
+    # 通过 trigram 索引找到最相近的 chart_name
+    return registry.match_chart_name(chart_name)
 
 def get_variation_for_chart_type(chart_type, engine_preference=None):
     """
@@ -159,30 +591,16 @@ def get_variation_for_chart_type(chart_type, engine_preference=None):
     if not _variations_scanned:
         scan_variations()
     
-    chart_type = chart_type.lower()
     if engine_preference is None:
-        engine_preference = ['echarts_py', 'echarts-js', 'd3-js']
-    
-    # Try each engine in order of preference
-    for engine in engine_preference:
-        if chart_type in variations[engine]:
-            # 如果存在多个chart_name的variation，随机返回一个
-            chart_names = list(variations[engine][chart_type].keys())
-            if chart_names:
-                selected_name = random.choice(chart_names)
-                variation_info = variations[engine][chart_type][selected_name]
-                return variation_info['engine_type'], variation_info['variation']
+        engine_preference = ('echarts_py', 'echarts-js', 'd3-js')
     
-    # Try partial matches
-    for engine in engine_preference:
-        for variation_type in variations[engine]:
-            if chart_type in variation_type or variation_type in chart_type:
-                # 随机选择一个chart_name
-                chart_names = list(variations[engine][variation_type].keys())
-                if chart_names:
-                    selected_name = random.choice(chart_names)
-                    variation_info = variations[engine][variation_type][selected_name]
-                    return variation_info['engine_type'], variation_info['variation']
+    # 只读取一次当前扫描结果，保证行号与存储出自同一次扫描
+    registry = _registry
+    candidates = _resolve_variation_for_chart_type(registry, chart_type.lower(), tuple(engine_preference))
+    if candidates:
+        # 如果存在多个chart_name的variation，随机返回一个
+        row = _rand_choice(candidates)
+        return registry.store.engines[row], _resolve_variation(registry, row)
     
     return None, None
 
@@ -204,43 +622,11 @@ def get_variation_for_chart_name(chart_name, engine_preference=None):
     if not _variations_scanned:
         scan_variations()
     
-    chart_name = chart_name.lower()
-    
-    # Try each engine in order of preference
-    for engine in variations:
-        for chart_type, chart_dict in variations[engine].items():
-            if chart_name in chart_dict:
-                variation_info = chart_dict[chart_name]
-                return variation_info['engine_type'], variation_info['variation']
-    
-    # Try partial matches
-    # for engine in engine_preference:
-    #     for chart_type, chart_dict in variations[engine].items():
-    #         for name in chart_dict:
-    #             if chart_name in name or name in chart_name:
-    #                 return chart_dict[name]
-    
-    # 找到重叠最多的匹配
-    best_match = None
-    max_overlap = 0
-    best_result = None
-    # print("chart_dict:", variations[engine])
-    
-    for engine in variations:
-        for chart_type, chart_dict in variations[engine].items():
-            for name in chart_dict:
-                # 计算两个字符串的重叠长度
-                overlap = len(set(chart_name) & set(name))
-                if overlap > max_overlap:
-                    #print("overlap:", overlap)
-                    max_overlap = overlap
-                    best_match = name
-                    #print("best_match:", best_match)
-                    variation_info = chart_dict[name]
-                    best_result = (variation_info['engine_type'], variation_info['variation'])
-                    #print("best_result:", best_result)
-    if best_result:
-        return best_result
+    # 只读取一次当前扫描结果，保证行号与存储出自同一次扫描
+    registry = _registry
+    row = _resolve_variation_for_chart_name(registry, chart_name.lower())
+    if row is not None:
+        return registry.store.engines[row], _resolve_variation(registry, row)
     
     return None, None
 
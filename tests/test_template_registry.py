@@ -0,0 +1,604 @@
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.chart_engine.variation import template_registry as tr
+
+# relative path -> (chart_type, chart_name)
+TEMPLATES = {
+    'echarts_py/pie_basic.py': ('Pie Chart', 'pie_chart_01'),
+    'echarts_py/__init__.py': ('Ignored Chart', 'ignored_chart'),
+    'echarts-js/line/line_chart_01.js': ('Line Chart', 'line_chart_01'),
+    'echarts-js/shared.js': ('Area Chart', 'shared_chart'),
+    'd3-js/bar/horizontal_bar_chart_01.js': ('Horizontal Bar Chart', 'horizontal_bar_chart_01'),
+    'd3-js/bar/horizontal_bar_chart_02.js': ('Horizontal Bar Chart', 'horizontal_bar_chart_02'),
+    'd3-js/donut_chart_01.js': ('Donut Chart', 'donut_chart_01'),
+    'd3-js/shared.js': ('Area Chart', 'shared_chart'),
+    'vegalite_py/shared.py': ('Area Chart', 'shared_chart'),
+    'vegalite_py/__nested/scatter.py': ('Scatter Plot', 'scatter_plot_01'),
+}
+
+
+def requirements_block(chart_type, chart_name):
+    return (
+        'REQUIREMENTS_BEGIN\n'
+        f'{{"chart_type": "{chart_type}", "chart_name": "{chart_name}"}}\n'
+        'REQUIREMENTS_END'
+    )
+
+
+def write_template(path, chart_type, chart_name, body='X = 1\n'):
+    """Write a minimal .py or .js template with a requirements block"""
+    block = requirements_block(chart_type, chart_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        if path.endswith('.py'):
+            f.write(f'"""\n{block}\n"""\n{body}')
+        else:
+            f.write(f'/*\n{block}\n*/\n')
+
+
+def path_of(root, rel_path):
+    return os.path.join(str(root), *rel_path.split('/'))
+
+
+# Python template body that records every time it is executed
+COUNTING_BODY = "with open(__file__ + '.runs', 'a') as f:\n    f.write('x')\n"
+
+
+def template_runs(path):
+    try:
+        with open(path + '.runs') as f:
+            return len(f.read())
+    except FileNotFoundError:
+        return 0
+
+
+@pytest.fixture
+def registry_dir(tmp_path, monkeypatch):
+    """Point the registry at a small template tree and restore its state afterwards"""
+    for rel_path, (chart_type, chart_name) in TEMPLATES.items():
+        write_template(path_of(tmp_path, rel_path), chart_type, chart_name)
+    (tmp_path / 'd3-js' / 'utils.js').write_text('// no requirements block\n')
+
+    monkeypatch.setattr(tr, '_VARIATION_DIR', str(tmp_path))
+    monkeypatch.setattr(tr, '_CACHE_PATH', str(tmp_path / '.template_registry.cache.json'))
+    monkeypatch.setattr(tr, '_variations_scanned', False)
+    monkeypatch.setattr(tr, '_registry', tr._registry)
+    yield tmp_path
+
+
+@pytest.fixture
+def count_extracts(monkeypatch):
+    """Record the files whose requirements are read from disk"""
+    extracted = []
+    extract = tr.extract_requirements
+
+    def counting_extract(file_path):
+        extracted.append(file_path)
+        return extract(file_path)
+
+    monkeypatch.setattr(tr, 'extract_requirements', counting_extract)
+    return extracted
+
+
+def test_scan_cache_hit_and_mtime_miss(registry_dir, count_extracts):
+    tr.scan_variations(force=True)
+    assert os.path.exists(tr._CACHE_PATH)
+    count_extracts.clear()
+
+    # unchanged files are served from the cache
+    tr.scan_variations(force=True)
+    assert count_extracts == []
+    assert tr.get_variation_for_chart_name('donut_chart_01')[0] == 'd3-js'
+
+    # a changed mtime forces that single file to be re-read
+    donut_path = path_of(registry_dir, 'd3-js/donut_chart_01.js')
+    write_template(donut_path, 'Donut Chart', 'donut_chart_02')
+    mtime_ns = os.stat(donut_path).st_mtime_ns + 10 ** 9
+    os.utime(donut_path, ns=(mtime_ns, mtime_ns))
+
+    tr.scan_variations(force=True)
+    assert count_extracts == [donut_path]
+    assert set(tr.variations['d3-js']['donut chart']) == {'donut_chart_02'}
+
+
+@pytest.mark.parametrize('make_cache', [
+    lambda path, mtime: 'not json',
+    lambda path, mtime: [],
+    lambda path, mtime: {'version': tr._CACHE_VERSION, 'files': []},
+    lambda path, mtime: {'version': tr._CACHE_VERSION, 'files': {path: 5}},
+    lambda path, mtime: {'version': tr._CACHE_VERSION, 'files': {path: {'mtime': str(mtime)}}},
+    lambda path, mtime: {
+        'version': tr._CACHE_VERSION,
+        'files': {path: {'mtime': mtime, 'requirements': 'chart_type'}},
+    },
+])
+def test_malformed_scan_cache_is_ignored(registry_dir, count_extracts, make_cache):
+    donut_path = path_of(registry_dir, 'd3-js/donut_chart_01.js')
+    cache = make_cache(donut_path, os.stat(donut_path).st_mtime_ns)
+    with open(tr._CACHE_PATH, 'w', encoding='utf-8') as f:
+        f.write(cache if isinstance(cache, str) else json.dumps(cache))
+
+    tr.scan_variations(force=True)
+    assert donut_path in count_extracts
+    assert tr.get_variation_for_chart_name('donut_chart_01') == ('d3-js', donut_path)
+
+    # the broken cache is replaced by a valid one
+    count_extracts.clear()
+    tr.scan_variations(force=True)
+    assert count_extracts == []
+
+
+def test_scan_registers_templates(registry_dir):
+    # __pycache__ never holds templates and is not descended into
+    write_template(path_of(registry_dir, 'vegalite_py/__pycache__/cached.py'), 'Cached Chart', 'cached_chart')
+    tr.scan_variations(force=True)
+
+    assert set(tr.variations['echarts_py']) == {'pie chart'}
+    assert set(tr.variations['echarts-js']) == {'line chart', 'area chart'}
+    assert set(tr.variations['d3-js']) == {'horizontal bar chart', 'donut chart', 'area chart'}
+    assert set(tr.variations['d3-js']['horizontal bar chart']) == {
+        'horizontal_bar_chart_01', 'horizontal_bar_chart_02'
+    }
+    # dunder directories are scanned, only dunder files are skipped
+    assert set(tr.variations['vegalite_py']) == {'area chart', 'scatter plot'}
+    assert set(tr.variations['vegalite_py']['scatter plot']) == {'scatter_plot_01'}
+
+
+def test_scan_directory_skips_missing_directory(registry_dir):
+    tr.scan_directory(path_of(registry_dir, 'missing'), 'd3-js', '.js')
+
+
+def test_python_templates_load_on_first_lookup(registry_dir):
+    path = path_of(registry_dir, 'echarts_py/counted.py')
+    write_template(path, 'Counted Chart', 'counted_chart_01', COUNTING_BODY)
+    tr.scan_variations(force=True)
+    assert template_runs(path) == 0
+
+    engine, module = tr.get_variation_for_chart_name('counted_chart_01')
+    assert engine == 'echarts_py'
+    assert module.__file__ == path
+    assert tr.get_variation_for_chart_type('Counted Chart') == ('echarts_py', module)
+    assert template_runs(path) == 1
+
+
+def test_eager_load_runs_each_template_once_per_scan(registry_dir, monkeypatch):
+    monkeypatch.setattr(tr, '_EAGER_LOAD', True)
+    path = path_of(registry_dir, 'echarts_py/counted.py')
+    write_template(path, 'Counted Chart', 'counted_chart_01', COUNTING_BODY)
+
+    tr.scan_variations(force=True)
+    assert template_runs(path) == 1
+    module = tr.get_variation_for_chart_name('counted_chart_01')[1]
+    assert tr.get_variation_for_chart_type('counted chart') == ('echarts_py', module)
+    assert template_runs(path) == 1
+
+    tr.scan_variations(force=True)
+    assert template_runs(path) == 2
+    assert tr.get_variation_for_chart_name('counted_chart_01')[1] is not module
+    assert template_runs(path) == 2
+
+
+def test_python_template_named_like_imported_module(registry_dir):
+    path = path_of(registry_dir, 'echarts_py/random.py')
+    write_template(path, 'Random Chart', 'random_chart_01', 'import random\nVALUE = random.__name__\n')
+    tr.scan_variations(force=True)
+
+    engine, module = tr.get_variation_for_chart_name('random_chart_01')
+    assert engine == 'echarts_py'
+    assert module.VALUE == 'random'
+    assert type(module) is type(tr)
+
+
+def test_broken_python_template_raises_on_every_lookup(registry_dir):
+    path = path_of(registry_dir, 'echarts_py/broken.py')
+    write_template(path, 'Broken Chart', 'broken_chart_01', "raise RuntimeError('broken template')\n")
+    tr.scan_variations(force=True)
+
+    for _ in range(2):
+        with pytest.raises(RuntimeError, match='broken template'):
+            tr.get_variation_for_chart_name('broken_chart_01')
+
+
+def test_extract_requirements_reads_past_head_for_late_end_marker(tmp_path):
+    path = tmp_path / 'long.js'
+    padding = 'x' * (tr.REQUIREMENTS_HEAD_SIZE * 2)
+    path.write_text(
+        '/*\nREQUIREMENTS_BEGIN\n'
+        f'{{"chart_type": "Long Chart", "padding": "{padding}"}}\n'
+        'REQUIREMENTS_END\n*/\n'
+    )
+    assert tr.extract_requirements(str(path)) == {'chart_type': 'Long Chart', 'padding': padding}
+
+
+def test_extract_requirements_skips_mentioned_marker_before_long_block(tmp_path):
+    path = tmp_path / 'long.js'
+    padding = 'x' * tr.REQUIREMENTS_HEAD_SIZE
+    path.write_text(
+        '// see REQUIREMENTS_BEGIN and REQUIREMENTS_END\n'
+        '/*\nREQUIREMENTS_BEGIN\n'
+        f'{{"chart_type": "Long Chart", "padding": "{padding}"}}\n'
+        'REQUIREMENTS_END\n*/\n'
+    )
+    assert tr.extract_requirements(str(path)) == {'chart_type': 'Long Chart', 'padding': padding}
+
+
+def test_extract_requirements_ignores_block_starting_after_head(tmp_path):
+    path = tmp_path / 'helper.js'
+    path.write_text(
+        '// see REQUIREMENTS_BEGIN and REQUIREMENTS_END\n'
+        + ' ' * tr.REQUIREMENTS_HEAD_SIZE
+        + '/*\nREQUIREMENTS_BEGIN\n{"chart_type": "Late Chart"}\nREQUIREMENTS_END\n*/\n'
+    )
+    assert tr.extract_requirements(str(path)) is None
+
+
+@pytest.mark.parametrize('content, expected', [
+    (b'/*\nREQUIREMENTS_BEGIN\n{"chart_type": "Bar"}\nREQUIREMENTS_END\n*/', {'chart_type': 'Bar'}),
+    (b'REQUIREMENTS_BEGIN {"a": {"b": 1}} REQUIREMENTS_END', {'a': {'b': 1}}),
+    # a marker mentioned before the real block is skipped, as with the old regex
+    (b'// see REQUIREMENTS_BEGIN docs\n/*\nREQUIREMENTS_BEGIN\n{"chart_type": "Bar"}\nREQUIREMENTS_END\n*/',
+     {'chart_type': 'Bar'}),
+    (b'// no block at all', None),
+    (b'REQUIREMENTS_BEGIN\n{"chart_type": "Bar"}\n', None),
+    (b'REQUIREMENTS_BEGIN\n["Bar"]\nREQUIREMENTS_END', None),
+    (b'REQUIREMENTS_BEGIN\nchart_type: Bar\nREQUIREMENTS_END', None),
+])
+def test_extract_requirements_block(tmp_path, content, expected):
+    path = tmp_path / 'template.js'
+    path.write_bytes(content)
+    assert tr.extract_requirements(str(path)) == expected
+
+
+@pytest.fixture(params=['fast', 'stdlib'])
+def json_parser(request, monkeypatch):
+    """Run a test with the fastest installed JSON parser and with the stdlib fallback alone"""
+    if request.param == 'stdlib':
+        monkeypatch.setattr(tr, '_json_loads', json.loads)
+        monkeypatch.setattr(tr, '_JSONDecodeError', json.JSONDecodeError)
+    return request.param
+
+
+def test_extract_requirements_accepts_non_finite_numbers(tmp_path, json_parser):
+    path = tmp_path / 'template.js'
+    path.write_bytes(b'REQUIREMENTS_BEGIN {"chart_type": "Bar", "max": NaN, "min": -Infinity} REQUIREMENTS_END')
+    requirements = tr.extract_requirements(str(path))
+    assert requirements['chart_type'] == 'Bar'
+    assert math.isnan(requirements['max'])
+    assert requirements['min'] == -math.inf
+
+
+def test_extract_requirements_warns_on_invalid_json(tmp_path, capsys, json_parser):
+    path = tmp_path / 'template.js'
+    path.write_bytes(b'REQUIREMENTS_BEGIN {"chart_type": "Bar",} REQUIREMENTS_END')
+    assert tr.extract_requirements(str(path)) is None
+    assert 'Invalid JSON' in capsys.readouterr().out
+
+
+def test_extract_requirements_warns_on_non_utf8_blob(tmp_path, capsys, json_parser):
+    path = tmp_path / 'latin1.js'
+    path.write_bytes('/*\nREQUIREMENTS_BEGIN\n{"chart_type": "Caf\u00e9 Chart"}\nREQUIREMENTS_END\n*/\n'.encode('latin-1'))
+    assert tr.extract_requirements(str(path)) is None
+    assert 'Invalid JSON' in capsys.readouterr().out
+
+
+def test_scan_cache_round_trips_non_finite_numbers(registry_dir, count_extracts, json_parser):
+    path = path_of(registry_dir, 'd3-js/limits.js')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('/*\nREQUIREMENTS_BEGIN\n{"chart_type": "Limit Chart", "max": Infinity}\nREQUIREMENTS_END\n*/\n')
+    tr.scan_variations(force=True)
+    count_extracts.clear()
+
+    tr.scan_variations(force=True)
+    assert count_extracts == []
+    assert tr.variations['d3-js']['limit chart']['limits']['requirements']['max'] == math.inf
+
+
+def test_first_engine_wins_after_parallel_scan(registry_dir, monkeypatch):
+    scan_directory = tr.scan_directory
+
+    def slow_early_engines(dir_path, engine_type, *args, **kwargs):
+        # make the engines that come first finish last
+        if engine_type in ('echarts_py', 'echarts-js'):
+            time.sleep(0.05)
+        return scan_directory(dir_path, engine_type, *args, **kwargs)
+
+    monkeypatch.setattr(tr, 'scan_directory', slow_early_engines)
+
+    shared = path_of(registry_dir, 'echarts-js/shared.js')
+    for _ in range(5):
+        tr.scan_variations(force=True)
+        assert list(tr.variations) == ['echarts_py', 'echarts-js', 'd3-js', 'vegalite_py']
+        assert tr.get_variation_for_chart_name('shared_chart') == ('echarts-js', shared)
+        assert tr.get_variation_for_chart_type('Area Chart') == ('echarts-js', shared)
+        assert tr.get_variation_for_chart_type('area chart', ['vegalite_py', 'd3-js', 'echarts-js']) == (
+            'vegalite_py', path_of(registry_dir, 'vegalite_py/shared.py')
+        )
+
+
+@pytest.mark.parametrize('chart_name, engine, rel_path', [
+    ('line_chart_01', 'echarts-js', 'echarts-js/line/line_chart_01.js'),
+    ('LINE_CHART_01', 'echarts-js', 'echarts-js/line/line_chart_01.js'),
+    ('donut_chart_01', 'd3-js', 'd3-js/donut_chart_01.js'),
+    ('scatter_plot_01', 'vegalite_py', 'vegalite_py/__nested/scatter.py'),
+    # the same chart_name in several engines resolves to the first engine
+    ('shared_chart', 'echarts-js', 'echarts-js/shared.js'),
+])
+def test_get_variation_for_chart_name_exact(registry_dir, chart_name, engine, rel_path):
+    assert tr.get_variation_for_chart_name(chart_name) == (engine, path_of(registry_dir, rel_path))
+
+
+def test_get_variation_for_chart_name_python_module(registry_dir):
+    engine, module = tr.get_variation_for_chart_name('pie_chart_01')
+    assert engine == 'echarts_py'
+    assert module.__file__ == path_of(registry_dir, 'echarts_py/pie_basic.py')
+
+
+# Expected results match the original character-overlap matcher on the same tree
+@pytest.mark.parametrize('chart_name, engine, rel_path', [
+    ('horizontal_bar', 'd3-js', 'd3-js/bar/horizontal_bar_chart_01.js'),
+    ('donut_01', 'd3-js', 'd3-js/donut_chart_01.js'),
+    ('line_chart', 'echarts-js', 'echarts-js/line/line_chart_01.js'),
+])
+def test_get_variation_for_chart_name_fuzzy(registry_dir, chart_name, engine, rel_path):
+    assert tr.get_variation_for_chart_name(chart_name) == (engine, path_of(registry_dir, rel_path))
+
+
+def test_get_variation_for_chart_name_fuzzy_python_module(registry_dir):
+    engine, module = tr.get_variation_for_chart_name('pie_chart')
+    assert engine == 'echarts_py'
+    assert module.__file__ == path_of(registry_dir, 'echarts_py/pie_basic.py')
+
+
+def test_get_variation_for_chart_name_without_shared_trigram(registry_dir):
+    # the character-overlap matcher returned an unrelated template here
+    assert tr.get_variation_for_chart_name('zzzz') == (None, None)
+
+
+@pytest.mark.parametrize('chart_type, engine_preference, engine, rel_path', [
+    ('Area Chart', None, 'echarts-js', 'echarts-js/shared.js'),
+    ('area chart', ['d3-js', 'echarts-js'], 'd3-js', 'd3-js/shared.js'),
+    ('Area Chart', ['vegalite_py'], 'vegalite_py', 'vegalite_py/shared.py'),
+    ('Donut Chart', None, 'd3-js', 'd3-js/donut_chart_01.js'),
+])
+def test_get_variation_for_chart_type_exact(registry_dir, chart_type, engine_preference, engine, rel_path):
+    assert tr.get_variation_for_chart_type(chart_type, engine_preference) == (engine, path_of(registry_dir, rel_path))
+
+
+def test_get_variation_for_chart_type_picks_randomly(registry_dir):
+    expected = {
+        path_of(registry_dir, 'd3-js/bar/horizontal_bar_chart_01.js'),
+        path_of(registry_dir, 'd3-js/bar/horizontal_bar_chart_02.js'),
+    }
+    picks = [tr.get_variation_for_chart_type('Horizontal Bar Chart', ['d3-js']) for _ in range(100)]
+    assert {engine for engine, _ in picks} == {'d3-js'}
+    assert {variation for _, variation in picks} == expected
+
+    # random.seed still controls the draws
+    random.seed(7)
+    first = [tr.get_variation_for_chart_type('Horizontal Bar Chart', ['d3-js']) for _ in range(10)]
+    random.seed(7)
+    assert [tr.get_variation_for_chart_type('Horizontal Bar Chart', ['d3-js']) for _ in range(10)] == first
+
+
+# Expected results match the original nested-loop partial matcher on the same tree
+@pytest.mark.parametrize('chart_type, engine_preference, engine, rel_paths', [
+    ('bar', ['d3-js'], 'd3-js',
+     {'d3-js/bar/horizontal_bar_chart_01.js', 'd3-js/bar/horizontal_bar_chart_02.js'}),
+    ('donut', None, 'd3-js', {'d3-js/donut_chart_01.js'}),
+    ('big donut chart thing', None, 'd3-js', {'d3-js/donut_chart_01.js'}),
+    ('scatter', ['vegalite_py'], 'vegalite_py', {'vegalite_py/__nested/scatter.py'}),
+    ('area', ['d3-js', 'echarts-js'], 'd3-js', {'d3-js/shared.js'}),
+])
+def test_get_variation_for_chart_type_partial(registry_dir, chart_type, engine_preference, engine, rel_paths):
+    expected = {path_of(registry_dir, rel_path) for rel_path in rel_paths}
+    for _ in range(10):
+        result_engine, variation = tr.get_variation_for_chart_type(chart_type, engine_preference)
+        assert result_engine == engine
+        assert variation in expected
+
+
+@pytest.mark.parametrize('engine_preference, engine', [
+    # an engine listed twice keeps its first position
+    (['vegalite_py', 'd3-js', 'vegalite_py'], 'vegalite_py'),
+    (['d3-js', 'vegalite_py', 'd3-js'], 'd3-js'),
+    # engines missing from the preference list are never returned
+    (['unknown', 'd3-js'], 'd3-js'),
+    (['unknown'], None),
+])
+def test_get_variation_for_chart_type_preference_rank(registry_dir, engine_preference, engine):
+    result_engine, variation = tr.get_variation_for_chart_type('Area Chart', engine_preference)
+    assert result_engine == engine
+    if engine is not None:
+        assert variation == tr.variations[engine]['area chart']['shared_chart']['variation']
+
+
+def test_get_variation_for_chart_type_partial_rank(registry_dir):
+    tr.scan_variations(force=True)
+    # preference decides the engine, then the first chart_type registered for it
+    first_echarts_js = next(chart_type for chart_type in tr.variations['echarts-js'] if 'chart' in chart_type)
+    expected = {info['variation'] for info in tr.variations['echarts-js'][first_echarts_js].values()}
+    for _ in range(10):
+        engine, variation = tr.get_variation_for_chart_type('chart', ['unknown', 'echarts-js', 'd3-js', 'echarts-js'])
+        assert engine == 'echarts-js'
+        assert variation in expected
+    assert tr.get_variation_for_chart_type('scatter', ['d3-js', 'vegalite_py', 'd3-js'])[0] == 'vegalite_py'
+
+
+def test_get_variation_for_chart_type_miss(registry_dir):
+    assert tr.get_variation_for_chart_type('radar') == (None, None)
+    assert tr.get_variation_for_chart_type('x' * 280) == (None, None)
+
+
+def test_partial_chart_type_matches_agree_with_nested_loop(registry_dir):
+    tr.scan_variations(force=True)
+    engines = list(tr.variations)
+    chart_types = sorted({chart_type for engine in engines for chart_type in tr.variations[engine]})
+
+    def expected_chart_type(query, engine_preference):
+        # the lookup as it was written before the indexes existed
+        for engine in engine_preference:
+            if query in tr.variations[engine]:
+                return engine, query
+        for engine in engine_preference:
+            for chart_type in tr.variations[engine]:
+                if query in chart_type or chart_type in query:
+                    return engine, chart_type
+        return None, None
+
+    rng = random.Random(0)
+    for _ in range(500):
+        base = rng.choice(chart_types)
+        i = rng.randrange(len(base))
+        query = rng.choice([
+            base[i:rng.randrange(i, len(base) + 1)],
+            ''.join(rng.choice('abc ') for _ in range(rng.randrange(4))) + base + rng.choice(['', ' x', 'zz']),
+            ''.join(rng.choice('aeinrt ') for _ in range(rng.randrange(1, 6))),
+        ])
+        engine_preference = rng.sample(engines, rng.randrange(1, len(engines) + 1))
+
+        engine, variation = tr.get_variation_for_chart_type(query, engine_preference)
+        expected_engine, chart_type = expected_chart_type(query, engine_preference)
+        assert engine == expected_engine
+        if engine is not None:
+            paths = {info['variation'] for info in tr.variations[engine][chart_type].values()}
+            assert getattr(variation, '__file__', variation) in {getattr(path, '__file__', path) for path in paths}
+
+
+def test_rescan_invalidates_cached_lookups(registry_dir):
+    donut = path_of(registry_dir, 'd3-js/donut_chart_01.js')
+    assert tr.get_variation_for_chart_type('ring') == (None, None)
+    assert tr.get_variation_for_chart_name('donut_chart_01') == ('d3-js', donut)
+
+    ring = path_of(registry_dir, 'echarts-js/ring.js')
+    write_template(ring, 'Ring Chart', 'donut_chart_01')
+    tr.scan_variations(force=True)
+    assert tr.get_variation_for_chart_type('ring') == ('echarts-js', ring)
+    assert tr.get_variation_for_chart_name('donut_chart_01') == ('echarts-js', ring)
+
+
+def test_variations_view_matches_legacy_format(registry_dir):
+    tr.scan_variations(force=True)
+    pie = tr.variations['echarts_py']['pie chart']['pie_chart_01']
+    assert pie['engine_type'] == 'echarts_py'
+    assert pie['variation'].__file__ == path_of(registry_dir, 'echarts_py/pie_basic.py')
+    assert pie['requirements'] == {'chart_type': 'Pie Chart', 'chart_name': 'pie_chart_01'}
+    assert tr.variations['d3-js']['donut chart']['donut_chart_01']['variation'] == path_of(
+        registry_dir, 'd3-js/donut_chart_01.js')
+    assert dict(tr.variations).keys() == {'echarts_py', 'echarts-js', 'd3-js', 'vegalite_py'}
+    with pytest.raises(KeyError):
+        tr.variations['missing']
+
+
+def test_variations_view_is_reused_until_rescan(registry_dir):
+    tr.scan_variations(force=True)
+    view = tr.variations['echarts_py']
+    assert tr.variations['echarts_py'] is view
+    assert tr.get_variation_for_chart_name('pie_chart_01')[1] is view['pie chart']['pie_chart_01']['variation']
+
+    tr.scan_variations(force=True)
+    assert tr.variations['echarts_py'] is not view
+
+
+def test_lookups_stay_consistent_during_rescans(registry_dir):
+    tr.scan_variations(force=True)
+    donut = path_of(registry_dir, 'd3-js/donut_chart_01.js')
+    stop = threading.Event()
+    errors = []
+
+    def read():
+        try:
+            while not stop.is_set():
+                assert tr.get_variation_for_chart_name('donut_chart_01') == ('d3-js', donut)
+                assert tr.get_variation_for_chart_type('donut chart', ['d3-js']) == ('d3-js', donut)
+                assert 'donut chart' in tr.variations['d3-js']
+        except Exception as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    try:
+        for _ in range(20):
+            tr.scan_variations(force=True)
+    finally:
+        stop.set()
+        for reader in readers:
+            reader.join()
+    assert errors == []
+
+
+def test_concurrent_first_lookups_scan_once(registry_dir, monkeypatch):
+    scanned = []
+    scan_directory = tr.scan_directory
+
+    def counting_scan(dir_path, engine_type, *args, **kwargs):
+        scanned.append(engine_type)
+        # keep the first scan running while the other callers arrive
+        time.sleep(0.05)
+        return scan_directory(dir_path, engine_type, *args, **kwargs)
+
+    monkeypatch.setattr(tr, 'scan_directory', counting_scan)
+    donut = path_of(registry_dir, 'd3-js/donut_chart_01.js')
+    barrier = threading.Barrier(8)
+    results = []
+
+    def lookup():
+        barrier.wait()
+        results.append(tr.get_variation_for_chart_name('donut_chart_01'))
+
+    callers = [threading.Thread(target=lookup) for _ in range(8)]
+    for caller in callers:
+        caller.start()
+    for caller in callers:
+        caller.join()
+    assert sorted(scanned) == sorted(engine for engine, _ in tr._ENGINE_EXTENSIONS)
+    assert results == [('d3-js', donut)] * 8
+
+
+def test_scan_directory_handles_nesting_deeper_than_recursion_limit(registry_dir):
+    # os.makedirs and shutil.rmtree recurse per level, so walk the directories by hand
+    dirs = [path_of(registry_dir, 'd3-js')]
+    for _ in range(sys.getrecursionlimit() + 10):
+        dirs.append(os.path.join(dirs[-1], 'd'))
+        os.mkdir(dirs[-1])
+    path = os.path.join(dirs[-1], 'deep.js')
+    write_template(path, 'Deep Chart', 'deep_chart_01')
+    try:
+        assert tr.get_variation_for_chart_name('deep_chart_01') == ('d3-js', path)
+    finally:
+        os.remove(path)
+        for deep_dir in reversed(dirs[1:]):
+            os.rmdir(deep_dir)
+
+
+def test_scan_directory_matches_several_extensions(registry_dir, monkeypatch):
+    monkeypatch.setattr(tr, '_ENGINE_EXTENSIONS', tuple(
+        (engine, ('.js', '.mjs') if engine == 'd3-js' else extension)
+        for engine, extension in tr._ENGINE_EXTENSIONS
+    ))
+    write_template(path_of(registry_dir, 'd3-js/module_chart.mjs'), 'Module Chart', 'module_chart_01')
+    write_template(path_of(registry_dir, 'd3-js/notes.txt'), 'Notes Chart', 'notes_chart_01')
+    # a directory with a template suffix is walked, not read
+    write_template(path_of(registry_dir, 'd3-js/folder.js/inner.js'), 'Inner Chart', 'inner_chart_01')
+    tr.scan_variations(force=True)
+
+    assert set(tr.variations['d3-js']) == {
+        'horizontal bar chart', 'donut chart', 'area chart', 'module chart', 'inner chart'
+    }
+
+
+def test_debug_prints_registered_templates(registry_dir, monkeypatch, capsys):
+    monkeypatch.setattr(tr, '_DEBUG', True)
+    tr.scan_variations(force=True)
+    out = capsys.readouterr().out
+    assert 'Registered d3-js variation: donut chart -> donut_chart_01 -> donut_chart_01.js' in out
+    assert f"Registered echarts-js variation: line chart -> line_chart_01 -> {os.path.join('line', 'line_chart_01.js')}" in out